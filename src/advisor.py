@@ -0,0 +1,421 @@
+import os
+import time
+import hashlib
+import sqlite3
+import functools
+import threading
+import unicodedata
+from contextlib import closing
+from types import SimpleNamespace
+
+import google.generativeai as genai
+
+import pdf_parser
+
+# --- Model Settings ---
+MODEL_NAME = "gemini-3-flash-preview"
+
+# Local fake model for offline testing of the chat UI, e.g.
+#   ADVISOR_FAKE_MODEL=1 ADVISOR_FAKE_FIRST_DELAY=1.0 ADVISOR_FAKE_CHUNK_DELAY=0.1 streamlit run src/app.py
+FAKE_MODEL_ENV = "ADVISOR_FAKE_MODEL"
+
+
+class FakeModel:
+    """
+    Stand-in for genai.GenerativeModel that answers from a canned text, split into chunks
+    emitted after configurable delays. Mimics generate_content(prompt, stream=...).
+    """
+    def __init__(self, response=None, chunk_size=12, first_delay=0.5, chunk_delay=0.05, model_name="fake"):
+        self.response = response
+        self.chunk_size = chunk_size
+        self.first_delay = first_delay
+        self.chunk_delay = chunk_delay
+        self.model_name = model_name
+
+    def _answer(self, prompt):
+        if self.response is not None:
+            return self.response
+        question = prompt.rsplit("ユーザーの質問:", 1)[-1].strip()
+        return f"【テスト応答】\n\nご質問「{question}」について、ローカルのテストモデルが応答しています。"
+
+    def _chunks(self, text):
+        time.sleep(self.first_delay)
+        for i in range(0, len(text), self.chunk_size):
+            if i:
+                time.sleep(self.chunk_delay)
+            yield SimpleNamespace(text=text[i:i + self.chunk_size])
+
+    def generate_content(self, prompt, stream=False, request_options=None):
+        text = self._answer(prompt)
+        if stream:
+            return self._chunks(text)
+        time.sleep(self.first_delay + self.chunk_delay * (len(text) // self.chunk_size))
+        return SimpleNamespace(text=text)
+
+
+@functools.lru_cache(maxsize=4)
+def get_model(api_key):
+    """
+    Returns the chat model: FakeModel when ADVISOR_FAKE_MODEL is set, the Gemini model
+    when an API key is configured, else None (the caller answers from keywords instead).
+    The client is created once per API key and reused by every session.
+    """
+    if os.environ.get(FAKE_MODEL_ENV):
+        return FakeModel(first_delay=float(os.environ.get("ADVISOR_FAKE_FIRST_DELAY", "0.5")),
+                         chunk_delay=float(os.environ.get("ADVISOR_FAKE_CHUNK_DELAY", "0.05")))
+    if api_key:
+        return genai.GenerativeModel(MODEL_NAME)
+    return None
+
+
+def model_name_of(model):
+    """Returns the model's name, used as part of the response cache key."""
+    return getattr(model, "model_name", MODEL_NAME)
+
+
+def stream_text(model, prompt, timeout=None):
+    """Yields the answer to prompt as text chunks, as the model produces them."""
+    request_options = {"timeout": timeout} if timeout else None
+    for chunk in model.generate_content(prompt, stream=True, request_options=request_options):
+        text = chunk.text
+        if text:
+            yield text
+
+
+# --- Shared Model Executor ---
+# All sessions send model calls through one LLMExecutor: bounded worker threads that reject
+# work beyond max_pending calls, gives up waiting after timeout seconds, and lets identical
+# in-flight requests share one model call (single flight).
+DEFAULT_MAX_CONCURRENCY = int(os.environ.get("ADVISOR_MAX_CONCURRENCY", "4"))
+DEFAULT_MAX_PENDING = int(os.environ.get("ADVISOR_MAX_PENDING", "16"))
+DEFAULT_TIMEOUT = float(os.environ.get("ADVISOR_TIMEOUT", "60"))
+
+
+class LLMBusyError(RuntimeError):
+    """Raised when the executor already has max_pending calls running or queued."""
+
+
+class _Flight:
+    """One in-flight model call. Chunks are kept so every waiting caller sees the full answer."""
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.cond = threading.Condition()
+
+    def add(self, text):
+        with self.cond:
+            self.chunks.append(text)
+            self.cond.notify_all()
+
+    def finish(self, error=None):
+        with self.cond:
+            self.done = True
+            self.error = error
+            self.cond.notify_all()
+
+    def iter_chunks(self, deadline):
+        i = 0
+        while True:
+            with self.cond:
+                while i >= len(self.chunks) and not self.done:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError("AIの応答がタイムアウトしました")
+                    self.cond.wait(remaining)
+                if i < len(self.chunks):
+                    chunk = self.chunks[i]
+                elif self.error is not None:
+                    raise self.error
+                else:
+                    return
+            i += 1
+            yield chunk
+
+
+class LLMExecutor:
+    """
+    Runs streaming model calls on bounded worker threads shared by all sessions.
+    stream() returns an iterator of text chunks; callers asking the same key while a
+    call is in flight are attached to it instead of starting another one.
+    Workers are daemon threads, so a model call that never returns cannot block shutdown.
+    """
+    def __init__(self, max_concurrency=DEFAULT_MAX_CONCURRENCY, max_pending=DEFAULT_MAX_PENDING,
+                 timeout=DEFAULT_TIMEOUT):
+        self.timeout = timeout
+        # Calls talking to the model at once
+        self._running = threading.BoundedSemaphore(max_concurrency)
+        # Running + queued calls; a full executor rejects new work instead of queueing forever
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def stream(self, model, prompt, key=None):
+        """
+        Yields the answer to prompt as text chunks. Raises LLMBusyError when the executor
+        is full and TimeoutError when no complete answer arrives within timeout seconds.
+        """
+        if key is None:
+            key = hashlib.sha256(f"{model_name_of(model)}\0{prompt}".encode("utf-8")).hexdigest()
+        deadline = time.monotonic() + self.timeout
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                if not self._slots.acquire(blocking=False):
+                    raise LLMBusyError("AIへの問い合わせが混雑しています")
+                flight = self._flights[key] = _Flight()
+                threading.Thread(target=self._run, args=(key, flight, model, prompt),
+                                 name="llm-call", daemon=True).start()
+        return flight.iter_chunks(deadline)
+
+    def _run(self, key, flight, model, prompt):
+        try:
+            with self._running:
+                for text in stream_text(model, prompt, timeout=self.timeout):
+                    flight.add(text)
+            flight.finish()
+        except Exception as e:
+            flight.finish(e)
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            self._slots.release()
+
+
+# --- Response Cache ---
+# Answers are reused across sessions and restarts while the model, system prompt,
+# financial context and (normalized) question are all unchanged.
+RESPONSE_CACHE_FILENAME = ".advisor_cache.sqlite"
+DEFAULT_CACHE_TTL = 7 * 24 * 3600  # seconds
+DEFAULT_CACHE_MAX_ENTRIES = 500
+
+
+def normalize_question(question):
+    """Folds width, case, whitespace and trailing punctuation so trivially different questions share a key."""
+    text = unicodedata.normalize("NFKC", question).lower()
+    return " ".join(text.split()).rstrip("?？!！。. ")
+
+
+def response_cache_key(model_name, system_prompt, context_data, question):
+    """Returns the SHA-256 cache key of one chat request."""
+    h = hashlib.sha256()
+    for part in (model_name, system_prompt, context_data, normalize_question(question)):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class ResponseCache:
+    """
+    Persistent LLM response cache in a SQLite file, shared by all sessions.
+    Entries expire after ttl seconds; beyond max_entries the least recently used are evicted.
+    A connection is opened per call, so the cache can be used from any Streamlit thread.
+    """
+    def __init__(self, path, ttl=DEFAULT_CACHE_TTL, max_entries=DEFAULT_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY, response TEXT NOT NULL,"
+                " created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def get(self, key):
+        """
+        Returns the cached response for key, or None if missing or expired.
+        Database errors (e.g. "database is locked") are logged and count as a miss.
+        """
+        now = time.time()
+        try:
+            with closing(self._connect()) as conn, conn:
+                row = conn.execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    return None
+                if now - row[1] > self.ttl:
+                    conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    return None
+                conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+                return row[0]
+        except sqlite3.Error as e:
+            print(f"Response cache read failed: {e}")
+            return None
+
+    def put(self, key, response):
+        """
+        Stores response under key, then drops expired and least recently used entries.
+        Database errors are logged and the response is simply not cached.
+        """
+        now = time.time()
+        try:
+            with closing(self._connect()) as conn, conn:
+                conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)", (key, response, now, now))
+                conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,))
+                conn.execute(
+                    "DELETE FROM responses WHERE key IN ("
+                    " SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+        except sqlite3.Error as e:
+            print(f"Response cache write failed: {e}")
+
+
+# --- Financial Context Builder ---
+# Adds the slice of the ledger that a question is about to the chat prompt: monthly series,
+# year-over-year deltas and the accounts that moved most, trimmed to a token budget.
+DEFAULT_CONTEXT_BUDGET = 800  # estimated tokens for the question-specific part
+
+# Named P&L / BS lines: (label, taxonomy group keys or balance sheet class keys)
+CONTEXT_LINES = {
+    "sales": ("売上高", ["design_sales", "ec_sales"]),
+    "cogs": ("売上原価", ["design_cost", "ec_cost"]),
+    "sga": ("販管費", ["sga"]),
+    "current_asset": ("流動資産", ["current_asset"]),
+    "current_liability": ("流動負債", ["current_liability"]),
+    "equity": ("純資産", ["equity"]),
+}
+# Derived lines: label -> (line added, line subtracted)
+DERIVED_LINES = {
+    "gross_profit": ("粗利益", "sales", "cogs"),
+    "operating_profit": ("営業利益", "gross_profit", "sga"),
+}
+
+# Question topics, matched on the same keywords as app.generate_contextual_response.
+# "items" are the groups / BS classes whose accounts are ranked as top movers.
+CONTEXT_TOPICS = [
+    {"keywords": ("粗利", "原価"), "lines": ["sales", "cogs", "gross_profit"],
+     "items": ["design_sales", "ec_sales", "design_cost", "ec_cost"]},
+    {"keywords": ("販管", "固定費", "コスト"), "lines": ["sga"], "items": ["sga"]},
+    {"keywords": ("利益", "営業", "赤字"), "lines": ["sales", "gross_profit", "sga", "operating_profit"],
+     "items": ["design_sales", "ec_sales", "design_cost", "ec_cost", "sga"]},
+    {"keywords": ("流動", "資金", "キャッシュ"), "lines": ["current_asset", "current_liability", "equity"],
+     "items": ["current_asset", "current_liability", "equity"]},
+]
+# Used when no keyword matches
+DEFAULT_TOPIC = CONTEXT_TOPICS[2]
+BS_KEYS = {"current_asset", "fixed_asset", "current_liability", "equity"}
+# Subtotal / breakdown lines of the trial balance (【 流動資産 】, 〔現金預金〕, (預金)) are not movers
+SUBTOTAL_PREFIXES = ("【", "〔", "(")
+
+
+def estimate_tokens(text):
+    """Rough token estimate: one per CJK character, one per four other characters."""
+    cjk = sum(1 for c in text if ord(c) >= 0x2E80)
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def match_topics(question):
+    """Returns the CONTEXT_TOPICS whose keywords appear in question (DEFAULT_TOPIC if none)."""
+    topics = [t for t in CONTEXT_TOPICS if any(k in question for k in t["keywords"])]
+    return topics or [DEFAULT_TOPIC]
+
+
+def _keys_mask(ledger, keys):
+    """Rows of ledger belonging to the given taxonomy group keys / balance sheet class keys."""
+    group_codes = pdf_parser.taxonomy_group_codes()
+    bs_classes = pdf_parser.taxonomy_bs_classes()
+    mask = ledger["GroupCode"].isin([group_codes[k] for k in keys if k in group_codes])
+    return mask | ledger["BSClass"].isin([bs_classes[k] for k in keys if k in bs_classes])
+
+
+def _line_series(fy_ledger, line, data_col, months):
+    """Returns (current, previous year) per-FiscalMonth sums of a named or derived line."""
+    if line in DERIVED_LINES:
+        _, plus, minus = DERIVED_LINES[line]
+        cur_p, prev_p = _line_series(fy_ledger, plus, data_col, months)
+        cur_m, prev_m = _line_series(fy_ledger, minus, data_col, months)
+        return cur_p - cur_m, prev_p - prev_m
+    keys = CONTEXT_LINES[line][1]
+    # Balance sheet lines are balances, so always read the cumulative columns
+    col = "Cumulative" if set(keys) <= BS_KEYS else data_col
+    rows = fy_ledger[_keys_mask(fy_ledger, keys)]
+    sums = rows.groupby("FiscalMonth")[[col, f"Prev_{col}"]].sum().reindex(months, fill_value=0)
+    return sums[col], sums[f"Prev_{col}"]
+
+
+def _line_label(line):
+    return DERIVED_LINES[line][0] if line in DERIVED_LINES else CONTEXT_LINES[line][0]
+
+
+def _k(value):
+    """Formats yen as thousands of yen."""
+    return f"{value / 1000:,.0f}"
+
+
+def _yoy(cur, prev):
+    return f"{(cur - prev) / abs(prev):+.1%}" if prev else "-"
+
+
+def build_financial_context(ledger, fiscal_year, fiscal_month, data_col, question, budget=DEFAULT_CONTEXT_BUDGET):
+    """
+    Returns the question-specific part of the chat context for fiscal_year up to fiscal_month:
+    monthly series of the relevant P&L/BS lines, their year-over-year deltas, the accounts
+    with the largest YoY change and those accounts' monthly series. Sections are added in
+    that order until the estimated token budget is used up.
+    """
+    fy_ledger = ledger[(ledger["FiscalYear"] == fiscal_year) & (ledger["FiscalMonth"] <= fiscal_month)]
+    if fy_ledger.empty:
+        return ""
+    months = list(range(1, fiscal_month + 1))
+    month_names = {fm: f"{m}月" for fm, m in zip(pdf_parser.fiscal_calendar()["FiscalMonth"],
+                                                pdf_parser.fiscal_calendar()["Month"])}
+    mode = "単月" if data_col == "Current" else "累計"
+    topics = match_topics(question)
+    lines = list(dict.fromkeys(line for t in topics for line in t["lines"]))
+    item_keys = list(dict.fromkeys(key for t in topics for key in t["items"]))
+
+    header = f"【質問に関連するデータ】({fiscal_year}年度 {month_names[1]}〜{month_names[fiscal_month]}, {mode}, 単位: 千円)"
+    sections = []
+
+    series = {line: _line_series(fy_ledger, line, data_col, months) for line in lines}
+    sections.append(("■ 月次推移", [
+        f"- {_line_label(line)}: " + " / ".join(f"{month_names[fm]} {_k(cur[fm])}" for fm in months)
+        for line, (cur, _) in series.items()
+    ]))
+    sections.append((f"■ 前年同月比 ({month_names[fiscal_month]})", [
+        f"- {_line_label(line)}: {_k(cur[fiscal_month])} (前年 {_k(prev[fiscal_month])}, {_yoy(cur[fiscal_month], prev[fiscal_month])})"
+        for line, (cur, prev) in series.items()
+    ]))
+
+    # Accounts with the largest absolute YoY change in the latest month
+    items = fy_ledger[_keys_mask(fy_ledger, item_keys)]
+    items = items[~items["Item"].astype(str).str.startswith(SUBTOTAL_PREFIXES)]
+    item_col = "Cumulative" if set(item_keys) <= BS_KEYS else data_col
+    latest = items[items["FiscalMonth"] == fiscal_month].groupby("Item", observed=True)[[item_col, f"Prev_{item_col}"]].sum()
+    latest["change"] = latest[item_col] - latest[f"Prev_{item_col}"]
+    movers = latest.reindex(latest["change"].abs().sort_values(ascending=False).index).head(10)
+    sections.append(("■ 前年同月比の変動が大きい科目", [
+        f"- {item}: {_k(row[item_col])} (前年 {_k(row[f'Prev_{item_col}'])}, 差 {_k(row['change'])})"
+        for item, row in movers.iterrows()
+    ]))
+    item_series = items[items["Item"].isin(movers.index)].pivot_table(
+        index="Item", columns="FiscalMonth", values=item_col, aggfunc="sum", observed=True
+    ).reindex(index=movers.index, columns=months, fill_value=0).fillna(0)
+    sections.append(("■ 主な科目の月次推移", [
+        f"- {item}: " + " / ".join(f"{month_names[fm]} {_k(v)}" for fm, v in values.items())
+        for item, values in item_series.iterrows()
+    ]))
+
+    # Fill the budget in priority order; a section is dropped once nothing more fits
+    out = [header]
+    used = estimate_tokens(header)
+    for title, section_lines in sections:
+        cost = estimate_tokens(title)
+        taken = []
+        for line in section_lines:
+            line_cost = estimate_tokens(line)
+            if used + cost + line_cost > budget:
+                break
+            taken.append(line)
+            cost += line_cost
+        if not taken:
+            break
+        out += [title] + taken
+        used += cost
+    return "\n".join(out) + "\n"
@@ -3,7 +3,7 @@ import pandas as pd
 
 def debug_fy():
     print("Loading all data...")
-    df = parser.load_all_data("input_data")
+    df = parser.load_ledger("input_data")
     if df.empty:
         print("DataFrame is empty!")
         return
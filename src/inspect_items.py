@@ -8,7 +8,7 @@ import pdf_parser
 
 def inspect_items():
     input_dir = "input_data"
-    df = pdf_parser.load_all_data(input_dir)
+    df = pdf_parser.load_ledger(input_dir)
     if df.empty:
         print("No data found.")
         return
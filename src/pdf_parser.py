@@ -1,10 +1,123 @@
 import pdfplumber
 import pandas as pd
+import numpy as np
 import os
 import re
+import hashlib
+import json
+import functools
+import shutil
+import sys
+import time
+import argparse
+import unicodedata
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
-# New parsing trace for UI visibility
-PARSING_TRACE = []
+try:
+    import resource  # Unix only; used for peak RSS reporting
+except ImportError:
+    resource = None
+
+# --- Parse Trace ---
+# One record per parsed page (page = 1, 2, ...) and per file (page = None)
+TRACE_COLUMNS = ["file", "page", "period", "strategy", "tables", "rows", "seconds", "status", "error"]
+
+class ParseTrace:
+    """
+    Bounded, thread-safe ring buffer of ingest records (dicts with TRACE_COLUMNS).
+    Shared by all dashboard sessions; the oldest records are dropped once maxlen is reached.
+    When disabled, append is a no-op and parse_pdf skips building records.
+    """
+    def __init__(self, maxlen=2000, enabled=True):
+        self.enabled = enabled
+        self._records = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+
+    def append(self, record):
+        if self.enabled:
+            with self._lock:
+                self._records.append(record)
+
+    def extend(self, records):
+        if self.enabled:
+            with self._lock:
+                self._records.extend(records)
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+
+    def records(self):
+        with self._lock:
+            return list(self._records)
+
+    def to_frame(self):
+        """Returns the records as a DataFrame, oldest first."""
+        df = pd.DataFrame(self.records(), columns=TRACE_COLUMNS)
+        return df.astype({"page": "Int64", "tables": "Int64", "rows": "Int64", "seconds": "float64"})
+
+# Ingest trace for UI visibility ("ファイル解析ログを表示"); PARSE_TRACE=0 disables it
+PARSE_TRACE = ParseTrace(maxlen=int(os.environ.get("PARSE_TRACE_SIZE", "2000")),
+                         enabled=os.environ.get("PARSE_TRACE", "1") != "0")
+
+def trace_record(file, page=None, period=None, strategy=None, tables=None, rows=None,
+                 seconds=None, status="ok", error=None):
+    """Builds one trace record (see TRACE_COLUMNS)."""
+    return {"file": file, "page": page, "period": period, "strategy": strategy, "tables": tables,
+            "rows": rows, "seconds": seconds, "status": status, "error": error}
+
+# --- Parse Cache Settings ---
+# Bump PARSER_VERSION whenever parse_pdf output changes, so old cache entries are ignored
+PARSER_VERSION = "3"
+# Cache directory name, created inside input_dir unless cache_dir is given
+CACHE_DIRNAME = ".parse_cache"
+# Temp files of interrupted cache writes older than this (seconds) are removed by prune_parse_cache
+CACHE_TMP_MAX_AGE = 3600
+
+# --- Ledger Store Settings ---
+# Parquet dataset partitioned by FiscalYear, created inside input_dir unless store_dir is given
+LEDGER_STORE_DIRNAME = ".ledger_store"
+# Metadata file inside the store (the "_" prefix keeps Parquet readers from treating it as data)
+LEDGER_META_FILENAME = "_ledger_meta.json"
+
+# --- Parallel Ingest Settings ---
+# Worker processes for parsing PDFs (PARSER_WORKERS=1 forces serial parsing, unset = all cores)
+DEFAULT_WORKERS = int(os.environ.get("PARSER_WORKERS", "0")) or None
+# Recycle parser processes after this many PDFs to return leaked memory to the OS (None = never)
+DEFAULT_MAX_TASKS_PER_CHILD = int(os.environ.get("PARSER_MAX_TASKS_PER_CHILD", "0")) or None
+
+# --- Calendar Settings ---
+# First calendar month of the fiscal year (4 = April start)
+FISCAL_START_MONTH = 4
+
+# --- Comparison Columns ---
+# prefix -> lag in months; add_lag_metrics creates <prefix>_Current / <prefix>_Cumulative.
+# e.g. {"Prev": 12, "PrevMonth": 1, "Prev2Y": 24}
+LAG_COLUMNS = {"Prev": 12}
+
+# --- Account Taxonomy ---
+# Maps account names (and aliases) to P&L groups; see account_taxonomy.json
+TAXONOMY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "account_taxonomy.json")
+# GroupCode of accounts that belong to no taxonomy group
+GROUP_CODE_NONE = 0
+# BSClass of accounts that are not classified as a balance sheet line
+BS_CLASS_NONE = 0
+
+# --- Compact Ledger Layout ---
+# Applied once at ingest by compact_ledger. Amounts stay float64: yen balances exceed
+# the 24-bit mantissa of float32 (~16.7M), so downcasting would lose whole yen.
+WHITESPACE_RE = re.compile(r"\s+")
+CATEGORY_COLUMNS = ["Item", "Source", "Type"]
+INTEGER_COLUMNS = {
+    "Year": "int16",
+    "Month": "int8",
+    "FiscalYear": "int16",
+    "FiscalMonth": "int8",
+    "Period": "int32",
+    "Previous": "int8",
+}
 
 # Translation dictionary matching generate_dummy.py keys to Japanese strict names
 # Based on User Image
@@ -53,13 +166,8 @@ TRANSLATION_MAP = {
     "Misc": "雑費"
 }
 
-def parse_pdf(filepath):
-    """
-    Parses a single PDF file and returns a structured dictionary or DataFrame.
-    Supports both "Dummy" format (4 columns) and "Real Trial Balance" format (~8 columns).
-    """
-    data = []
-    filename = os.path.basename(filepath)
+def parse_period_from_filename(filename):
+    """Returns (year, month) of a trial balance PDF, derived from its filename alone."""
     # --- Definitive Robust Filename Parsing ---
     # 1. Search for YYYYMM (6 digits starting with 20)
     yyyymm_match = re.search(r'(20\d{2})(0[1-9]|1[0-2])', filename)
@@ -83,180 +191,637 @@ def parse_pdf(filepath):
             if 1 <= int(d) <= 12:
                 month = int(d)
                 break
-    
-    PARSING_TRACE.append(f"Parsing: {filename} -> Result: {year}-{month}")
-    print(f"[DEBUG_PARSER] Filename: {filename} -> Parsed: {year}-{month}")
+    return year, month
+
+def period_label(year, month):
+    """Returns "YYYY-MM" for trace records and logs."""
+    return f"{year}-{month:02d}"
+
+def fiscal_year_of(year, month, fiscal_start_month=FISCAL_START_MONTH):
+    """Returns the fiscal year that calendar (year, month) belongs to."""
+    return year if month >= fiscal_start_month else year - 1
+
+def discover_fiscal_years(input_dir):
+    """Returns the fiscal years present in input_dir (newest first), from filenames only - no parsing."""
+    if not os.path.isdir(input_dir):
+        return []
+    fiscal_years = {
+        fiscal_year_of(*parse_period_from_filename(f))
+        for f in os.listdir(input_dir) if f.endswith(".pdf")
+    }
+    return sorted(fiscal_years, reverse=True)
+
+# One-pass cell normalization: special minus char (U+E538) and others -> "-", drop separators
+NUMBER_CLEAN = str.maketrans({"\ue538": "-", "△": "-", "▲": "-", ",": None, "%": None})
+# Characters ignored when checking whether a cell or name is "effectively a number"
+NUMBER_LIKE_STRIP = str.maketrans(dict.fromkeys(",.-\ue538△▲"))
+NAME_CHECK_STRIP = str.maketrans(dict.fromkeys(",\ue538△▲"))
+
+def parse_amount(s):
+    """Parses a table cell like '1,234', '△500' or '12.5%' to float; None if empty or not a number."""
+    if not s: return None # Distinguish empty from 0
+    try:
+        return float(s.translate(NUMBER_CLEAN))
+    except ValueError:
+        return None
+
+def _table_rows(tables, year, month, filename):
+    """Yields row dicts from the extracted tables of one page (real trial balance format)."""
+    for table in tables:
+        for row in table:
+            # Clean None
+            row = [str(x).strip() if x is not None else "" for x in row]
+
+            # Skip empty rows or headers
+            if not any(row) or "Account Item" in row or "勘 定 科 目" in row:
+                continue
+
+            # REAL FORMAT (approx 8 cols)
+            # Debug showed: [None, None, Name, Prev, Debit, Credit, Curr, Ratio]
+            if len(row) >= 6:
+                # Try to find name in first few columns
+                name = ""
+                # Priority: Row[2] (Primary), then others for totals
+                if row[2] and str(row[2]).strip():
+                    name = str(row[2])
+                else:
+                    # Join all non-numeric cells to find labels like 【 流動資産 】
+                    labels = []
+                    for cell in row[:3]: # Only search first few cols for labels
+                        # Check if cell is effectively a number (including negative signs like )
+                        if cell:
+                            if not cell.translate(NUMBER_LIKE_STRIP).isdigit():
+                                labels.append(str(cell))
+                    name = " ".join(labels)
+
+                # Full-width -> half-width (e.g., ＥＣ -> EC), no whitespace, aliases resolved
+                name = normalize_account_name(name)
+
+                # Final Filter: Reject if it looks like a number (after normalization and cleaning)
+                # This handles cases where garbage was joined
+                check_name = name.translate(NAME_CHECK_STRIP)
+                if any(c.isdigit() for c in check_name) and len(check_name) > 3 and "売上" not in check_name: 
+                    # Heuristic: If it has digits and no known keywords, and looks like a number artifact
+                    # Further refinement: if it is mostly digits
+                    digit_count = sum(c.isdigit() for c in check_name)
+                    if digit_count / len(check_name) > 0.5:
+                        continue
+
+                if not name: continue
+
+                # Special Handling for Operating Profit
+                if "営業損益金額" in name or "営業利益" in name:
+                    name = "営業利益"
+
+                try:
+                    # Extract all numbers in the row
+                    numbers = [val for val in map(parse_amount, row) if val is not None]
+
+                    # Logic: [Prev, (Debit, Credit...), Current, Ratio]
+                    # curr_bal (Current Balance) is the YTD total.
+                    # prev_bal (Previous Balance) is the total up to last month.
+                    if len(numbers) >= 3:
+                        prev_bal = numbers[0]
+                        curr_bal = numbers[-2] # The one before ratio
+
+                        # Calculate Flow (Monthly change)
+                        # For April (Month 4 = start of fiscal year), 
+                        # the "previous balance" in PDF might be from prior FY,
+                        # so we use Cumulative as Current for FY start month.
+                        if month == FISCAL_START_MONTH:
+                            flow_val = curr_bal  # First month of FY: Current = Cumulative
+                        else:
+                            flow_val = curr_bal - prev_bal
+
+                        yield {
+                            "Year": year,
+                            "Month": month,
+                            "Item": name, 
+                            "Current": flow_val,     # Monthly Flow
+                            "Cumulative": curr_bal,  # YTD Total
+                            "Previous": 0,           # To be populated in load_all_data
+                            "Source": filename,
+                            "Type": "Real"
+                        }
+                except (IndexError, ValueError):
+                    continue
+
+def _text_rows(text, year, month, filename):
+    """Yields row dicts from the text of one page (dummy / plain text format)."""
+    lines = text.split('\n')
+    for line in lines:
+        parts = line.split()
+        if len(parts) >= 2:
+            try:
+                # Helper to check if string is a number
+                def is_num(s): return re.match(r'^-?[\d,]+(\.\d+)?%?$', s)
+
+                # Find indices of numbers from the end
+                num_indices = [i for i, p in enumerate(parts) if is_num(p)]
+
+                if len(num_indices) >= 2:
+                    # Dummy Format: [Item Name] [Current] [Previous] [YoY]
+                    # Current is -3, Previous is -2
+
+                    if len(parts) >= 3 and is_num(parts[-3]):
+                        raw_item_name = " ".join(parts[:-3]).strip()
+                        curr_val = float(parts[-3].replace(',', ''))
+                        prev_val = float(parts[-2].replace(',', ''))
+
+                        clean_name = raw_item_name.strip()
+                        jp_name = normalize_account_name(TRANSLATION_MAP.get(clean_name, raw_item_name))
+
+                        yield {
+                            "Year": year,
+                            "Month": month,
+                            "Item": jp_name,
+                            "Current": curr_val,
+                            "Cumulative": curr_val, # To be recomputed in load_all_data
+                            "Previous": 0,
+                            "Source": filename,
+                            "Type": "Dummy"
+                        }
+            except Exception:
+                continue
+
+# --- Format Detection ---
+STRATEGY_TABLE = "table"  # Ruled trial balance from accounting software
+STRATEGY_TEXT = "text"    # Plain text layout (e.g. generate_dummy.py output)
+# Producer substrings (after NFKC) whose output layout is known
+TABLE_PRODUCERS = ("JDL",)
+TEXT_PRODUCERS = ("ReportLab",)
+
+def detect_strategy(pdf):
+    """
+    Decides once per document whether pages are parsed as ruled tables or as text,
+    from the Producer metadata and, for unknown producers, the first page's ruling lines.
+    """
+    producer = unicodedata.normalize("NFKC", pdf.metadata.get("Producer") or "")
+    if any(p in producer for p in TABLE_PRODUCERS):
+        return STRATEGY_TABLE
+    if any(p in producer for p in TEXT_PRODUCERS):
+        return STRATEGY_TEXT
+    if not pdf.pages:
+        return STRATEGY_TEXT
+    # Table cells need vertical rules; text layouts draw at most a horizontal separator
+    return STRATEGY_TABLE if pdf.pages[0].vertical_edges else STRATEGY_TEXT
+
+def iter_pdf_pages(filepath, trace=PARSE_TRACE):
+    """
+    Parses a single PDF file page by page, yielding one list of row dicts per page.
+    Supports both "Dummy" format (4 columns) and "Real Trial Balance" format (~8 columns).
+    Only one page's rows are held at a time, so callers can stream them into a writer or aggregator.
+    A record per page is appended to trace (a ParseTrace or a plain list; None disables it).
+    """
+    filename = os.path.basename(filepath)
+    year, month = parse_period_from_filename(filename)
+    tracing = trace is not None and getattr(trace, "enabled", True)
+    period = period_label(year, month)
 
-    
     with pdfplumber.open(filepath) as pdf:
+        strategy = detect_strategy(pdf)
         for page in pdf.pages:
-            tables = page.extract_tables()
-            
-            # --- STRATEGY 1: TABLE EXTRACTION (Real PDF) ---
-            if tables:
-                for table in tables:
-                    for row in table:
-                        # Clean None
-                        row = [str(x).strip() if x is not None else "" for x in row]
-                        
-                        # Skip empty rows or headers
-                        if not any(row) or "Account Item" in row or "勘 定 科 目" in row:
-                            continue
-                            
-                        # REAL FORMAT (approx 8 cols)
-                        # Debug showed: [None, None, Name, Prev, Debit, Credit, Curr, Ratio]
-                        if len(row) >= 6:
-                            # Try to find name in first few columns
-                            name = ""
-                            # Priority: Row[2] (Primary), then others for totals
-                            if row[2] and str(row[2]).strip():
-                                name = str(row[2])
-                            else:
-                                # Join all non-numeric cells to find labels like 【 流動資産 】
-                                labels = []
-                                for cell in row[:3]: # Only search first few cols for labels
-                                    # Check if cell is effectively a number (including negative signs like )
-                                    if cell:
-                                        s_cell = str(cell).replace(",","").replace(".","").replace("-","").replace("","").replace("△","").replace("▲","")
-                                        if not s_cell.isdigit():
-                                            labels.append(str(cell))
-                                name = " ".join(labels)
-                            
-                            name = name.replace("\n", "").replace(" ", "")
-                            
-                            # Normalize Full-width to Half-width (e.g., ＥＣ -> EC)
-                            name = name.translate(str.maketrans('０１２３４５６７８９ＡＢＣＤＥＦＧＨＩＪＫＬＭＮＯＰＱＲＳＴＵＶＷＸＹＺａｂｃｄｅｆｇｈｉｊｋｌｍｎｏｐｑｒｓｔｕｖｗｘｙｚ', '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'))
-                            
-                            # Final Filter: Reject if it looks like a number (after normalization and cleaning)
-                            # This handles cases where garbage was joined
-                            check_name = name.replace(",","").replace("","").replace("△","").replace("▲","")
-                            if any(c.isdigit() for c in check_name) and len(check_name) > 3 and "売上" not in check_name: 
-                                # Heuristic: If it has digits and no known keywords, and looks like a number artifact
-                                # Further refinement: if it is mostly digits
-                                digit_count = sum(c.isdigit() for c in check_name)
-                                if digit_count / len(check_name) > 0.5:
-                                    continue
-
-                            if not name: continue
-
-                            # Special Handling for Operating Profit
-                            if "営業損益金額" in name or "営業利益" in name:
-                                name = "営業利益"
-
-                            try:
-                                # Parsing Helper
-                                def parse_curr(s):
-                                    if not s: return None # Distinguish empty from 0
-                                    s = str(s)
-                                    # Replace special minus char () and others
-                                    s = s.replace('', '-').replace('△', '-').replace('▲', '-')
-                                    s = s.replace(',', '').replace('%', '')
-                                    try:
-                                        return float(s)
-                                    except ValueError:
-                                        return None
-
-                                # Extract all numbers in the row
-                                numbers = []
-                                for cell in row:
-                                    val = parse_curr(cell)
-                                    if val is not None:
-                                        numbers.append(val)
-                                
-                                # Logic: [Prev, (Debit, Credit...), Current, Ratio]
-                                # curr_bal (Current Balance) is the YTD total.
-                                # prev_bal (Previous Balance) is the total up to last month.
-                                if len(numbers) >= 3:
-                                    prev_bal = numbers[0]
-                                    curr_bal = numbers[-2] # The one before ratio
-                                    
-                                    # Calculate Flow (Monthly change)
-                                    # For April (Month 4 = start of fiscal year), 
-                                    # the "previous balance" in PDF might be from prior FY,
-                                    # so we use Cumulative as Current for FY start month.
-                                    if month == 4:
-                                        flow_val = curr_bal  # First month of FY: Current = Cumulative
-                                    else:
-                                        flow_val = curr_bal - prev_bal
-                                    
-                                    data.append({
-                                        "Year": year,
-                                        "Month": month,
-                                        "Item": name, 
-                                        "Current": flow_val,     # Monthly Flow
-                                        "Cumulative": curr_bal,  # YTD Total
-                                        "Previous": 0,           # To be populated in load_all_data
-                                        "Source": filename,
-                                        "Type": "Real"
-                                    })
-                            except (IndexError, ValueError):
-                                continue
-
-            # --- STRATEGY 2: TEXT EXTRACTION (Dummy PDF) ---
-            # If no tables found, or mixed content (Dummy PDF usually returns empty tables), try text
-            if not tables:
-                text = page.extract_text()
-                if not text: continue
-                
-                lines = text.split('\n')
-                for line in lines:
-                    parts = line.split()
-                    if len(parts) >= 2:
-                        try:
-                            # Helper to check if string is a number
-                            def is_num(s): return re.match(r'^-?[\d,]+(\.\d+)?%?$', s)
-                            
-                            # Find indices of numbers from the end
-                            num_indices = [i for i, p in enumerate(parts) if is_num(p)]
-                            
-                            if len(num_indices) >= 2:
-                                # Dummy Format: [Item Name] [Current] [Previous] [YoY]
-                                # Current is -3, Previous is -2
-                                
-                                if len(parts) >= 3 and is_num(parts[-3]):
-                                    raw_item_name = " ".join(parts[:-3]).strip()
-                                    curr_val = float(parts[-3].replace(',', ''))
-                                    prev_val = float(parts[-2].replace(',', ''))
-                                    
-                                    clean_name = raw_item_name.strip()
-                                    jp_name = TRANSLATION_MAP.get(clean_name, raw_item_name)
-                                    
-                                    data.append({
-                                        "Year": year,
-                                        "Month": month,
-                                        "Item": jp_name,
-                                        "Current": curr_val,
-                                        "Cumulative": curr_val, # To be recomputed in load_all_data
-                                        "Previous": 0,
-                                        "Source": filename,
-                                        "Type": "Dummy"
-                                    })
-                        except Exception:
-                            continue
-
-    return pd.DataFrame(data)
-
-def load_all_data(input_dir):
-    all_data = []
-    for f in os.listdir(input_dir):
-        if f.endswith(".pdf"):
+            start = time.perf_counter()
+            try:
+                # Text layouts have no ruled tables, so skip the costly table detection.
+                # Tables keep the default line-based settings: explicit column boundaries learned
+                # from a previous page were measured slower here (most time goes to layout parsing
+                # and cell text extraction) and split merged label cells such as 【 流動資産 】.
+                tables = page.extract_tables() if strategy == STRATEGY_TABLE else []
+
+                # --- STRATEGY 1: TABLE EXTRACTION (Real PDF) ---
+                if tables:
+                    rows = list(_table_rows(tables, year, month, filename))
+
+                # --- STRATEGY 2: TEXT EXTRACTION (Dummy PDF) ---
+                # If no tables found, or mixed content (Dummy PDF usually returns empty tables), try text
+                else:
+                    text = page.extract_text()
+                    rows = list(_text_rows(text, year, month, filename)) if text else []
+            finally:
+                # Drop the page's cached chars/lines/rects so memory stays flat on long documents
+                page.close()
+            if tracing:
+                trace.append(trace_record(filename, page.page_number, period, strategy, len(tables),
+                                          len(rows), time.perf_counter() - start))
+            yield rows
+
+def iter_pdf_rows(filepath, trace=PARSE_TRACE):
+    """Yields the row dicts of a PDF one at a time (see iter_pdf_pages)."""
+    for rows in iter_pdf_pages(filepath, trace):
+        yield from rows
+
+def parse_pdf(filepath, trace=PARSE_TRACE):
+    """
+    Parses a single PDF file and returns a DataFrame.
+    Supports both "Dummy" format (4 columns) and "Real Trial Balance" format (~8 columns).
+    """
+    return merge_alias_rows(pd.DataFrame(list(iter_pdf_rows(filepath, trace))))
+
+def merge_alias_rows(df):
+    """
+    Sums rows of one document that resolved to the same taxonomy account through aliases
+    (e.g. 地代家賃 and 支払家賃 both -> 地代家賃) into the first of them, so each
+    (Year, Month, Item, Source) is a single row before the YoY join (add_lag_metrics).
+    Other duplicate labels (e.g. repeated 営業利益 lines) are left as they are.
+    """
+    if df.empty:
+        return df
+    keys = ["Year", "Month", "Item", "Source"]
+    merged = df["Item"].isin(set(taxonomy_aliases().values())) & df.duplicated(keys, keep=False)
+    if not merged.any():
+        return df
+    df = df.copy()
+    df.loc[merged, ["Current", "Cumulative"]] = df[merged].groupby(keys)[["Current", "Cumulative"]].transform("sum")
+    return df[~(merged & df.duplicated(keys, keep="first"))].reset_index(drop=True)
+
+def file_cache_key(filepath):
+    """
+    Returns the cache key of a PDF: SHA-256 of parser version, taxonomy, filename and file content.
+    The filename is part of the key because parse_pdf derives Year/Month and Source from it,
+    the taxonomy because its aliases are resolved in parse_pdf (normalize_account_name).
+    """
+    h = hashlib.sha256()
+    h.update(PARSER_VERSION.encode("utf-8"))
+    # The loaded taxonomy, not the file: a reload also resets normalize_account_name
+    h.update(taxonomy_digest().encode("utf-8"))
+    h.update(os.path.basename(filepath).encode("utf-8"))
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _cache_path(cache_dir, key):
+    return os.path.join(cache_dir, f"v{PARSER_VERSION}_{key}.parquet")
+
+def load_cached_parse(cache_dir, key):
+    """Returns the cached parse_pdf result for key, or None on a cache miss."""
+    path = _cache_path(cache_dir, key)
+    if not os.path.exists(path):
+        return None
+    try:
+        return pd.read_parquet(path)
+    except Exception as e:
+        print(f"Cache read failed for {path}: {e}")
+        return None
+
+def store_cached_parse(cache_dir, key, df):
+    """Writes a parse_pdf result to the cache. Failures only cost a re-parse next time."""
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        path = _cache_path(cache_dir, key)
+        # Per-writer temp name: sessions parsing the same PDF at once must not share it
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            df.to_parquet(tmp_path, index=False)
+            # Atomic replace so concurrent readers never see a half-written file
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    except Exception as e:
+        print(f"Cache write failed for {key}: {e}")
+
+def prune_parse_cache(cache_dir):
+    """
+    Removes cache entries written by other parser versions, and temp files left behind
+    by interrupted writes (only old ones, so writes in progress are not disturbed).
+    """
+    if not os.path.isdir(cache_dir):
+        return
+    prefix = f"v{PARSER_VERSION}_"
+    stale_before = time.time() - CACHE_TMP_MAX_AGE
+    for f in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, f)
+        try:
+            if f.endswith(".parquet") and not f.startswith(prefix):
+                os.remove(path)
+            elif f.endswith(".tmp") and os.path.getmtime(path) < stale_before:
+                os.remove(path)
+        except OSError:
+            pass
+
+def _parse_file(filepath):
+    """
+    Process pool entry point. Returns (df, error, seconds, page trace records) instead of
+    raising, so one broken PDF does not abort the whole batch.
+    """
+    records = [] if PARSE_TRACE.enabled else None
+    start = time.perf_counter()
+    try:
+        df, error = parse_pdf(filepath, trace=records), None
+    except Exception as e:
+        df, error = None, f"{type(e).__name__}: {e}"
+    return df, error, time.perf_counter() - start, records or []
+
+def parse_files(filepaths, workers=DEFAULT_WORKERS, max_tasks_per_child=DEFAULT_MAX_TASKS_PER_CHILD):
+    """
+    Parses several PDFs, fanning out over a process pool unless workers == 1.
+    With max_tasks_per_child, the pool is torn down and recreated after each worker has had
+    about that many PDFs, so memory held by long-lived parser processes goes back to the OS.
+    Returns a list of (filepath, df, error, seconds) in the same order as filepaths.
+    """
+    if workers == 1 or len(filepaths) <= 1:
+        results = []
+        for p in filepaths:
+            df, error, seconds, trace = _parse_file(p)
+            PARSE_TRACE.extend(trace)
+            results.append((df, error, seconds))
+    else:
+        # Recycle by batch rather than via ProcessPoolExecutor(max_tasks_per_child=...),
+        # which forces the "spawn" start method and can hang on Python 3.11
+        pool_size = workers or os.cpu_count() or 1
+        batch_size = pool_size * max_tasks_per_child if max_tasks_per_child else len(filepaths)
+        results = []
+        for i in range(0, len(filepaths), batch_size):
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                for df, error, seconds, trace in executor.map(_parse_file, filepaths[i:i + batch_size]):
+                    PARSE_TRACE.extend(trace)
+                    results.append((df, error, seconds))
+    return [(p,) + result for p, result in zip(filepaths, results)]
+
+def peak_rss_mb():
+    """
+    Returns (this process, largest finished child) peak resident set size in MB,
+    or (None, None) where the resource module is unavailable.
+    """
+    if resource is None:
+        return None, None
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    unit = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / unit,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / unit)
+
+def add_calendar_columns(df, fiscal_start_month=FISCAL_START_MONTH):
+    """
+    Adds the calendar dimension derived from Year/Month:
+    FiscalYear, FiscalMonth (1 = fiscal_start_month) and Period (YYYYMM key).
+    """
+    year = df["Year"]
+    month = df["Month"]
+    df["FiscalYear"] = year - (month < fiscal_start_month).astype(year.dtype)
+    df["FiscalMonth"] = (month - fiscal_start_month) % 12 + 1
+    df["Period"] = year.astype("int32") * 100 + month
+    return df
+
+def fiscal_calendar(fiscal_start_month=FISCAL_START_MONTH):
+    """Returns the 12 months of a fiscal year as a DataFrame with FiscalMonth and Month columns."""
+    fiscal_months = np.arange(1, 13)
+    return pd.DataFrame({
+        "FiscalMonth": fiscal_months,
+        "Month": (fiscal_months + fiscal_start_month - 2) % 12 + 1,
+    })
+
+def compact_ledger(df):
+    """Converts the ledger to its compact dtype layout (categorical strings, small integers)."""
+    for col in CATEGORY_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype("category")
+    for col, dtype in INTEGER_COLUMNS.items():
+        if col in df.columns:
+            df[col] = df[col].astype(dtype)
+    return df
+
+# path -> ((mtime_ns, size), taxonomy, SHA-256 of the file content)
+_TAXONOMY_CACHE = {}
+
+def _loaded_taxonomy(path=TAXONOMY_PATH):
+    st = os.stat(path)
+    version = (st.st_mtime_ns, st.st_size)
+    cached = _TAXONOMY_CACHE.get(path)
+    if cached is None or cached[0] != version:
+        with open(path, "rb") as f:
+            raw = f.read()
+        cached = _TAXONOMY_CACHE[path] = (version, json.loads(raw), hashlib.sha256(raw).hexdigest())
+        if path == TAXONOMY_PATH:
+            # Aliases are resolved through this memo; drop names normalized with the old taxonomy
+            normalize_account_name.cache_clear()
+    return cached
+
+def load_taxonomy(path=TAXONOMY_PATH):
+    """
+    Loads the account taxonomy (groups with code, key, segment, pl_line and accounts).
+    Cached per file version (mtime, size), so edits to the JSON apply without a restart.
+    """
+    return _loaded_taxonomy(path)[1]
+
+def taxonomy_digest(path=TAXONOMY_PATH):
+    """Returns the SHA-256 of the taxonomy as currently loaded (see load_taxonomy)."""
+    return _loaded_taxonomy(path)[2]
+
+def taxonomy_items(group_key, taxonomy=None):
+    """Returns the account names of a taxonomy group, each followed by its aliases."""
+    taxonomy = taxonomy or load_taxonomy()
+    for group in taxonomy["groups"]:
+        if group["key"] == group_key:
+            return [name for account, aliases in group["accounts"].items() for name in [account] + aliases]
+    raise KeyError(f"Unknown taxonomy group: {group_key}")
+
+def taxonomy_group_codes(taxonomy=None):
+    """Returns {group key: integer group code}."""
+    taxonomy = taxonomy or load_taxonomy()
+    return {group["key"]: group["code"] for group in taxonomy["groups"]}
+
+def taxonomy_aliases(taxonomy=None):
+    """Returns {alias: canonical account name} for every alias in the taxonomy."""
+    taxonomy = taxonomy or load_taxonomy()
+    return {
+        alias: account
+        for group in taxonomy["groups"]
+        for account, aliases in group["accounts"].items()
+        for alias in aliases
+    }
+
+@functools.lru_cache(maxsize=None)
+def normalize_account_name(raw):
+    """
+    Returns the canonical form of an account label: NFKC (full-width letters/digits/brackets
+    to half-width), all whitespace removed and taxonomy aliases (給料手当 -> 給与手当) resolved.
+    Memoized, since a few hundred distinct labels repeat across every page and file.
+    """
+    name = WHITESPACE_RE.sub("", unicodedata.normalize("NFKC", raw))
+    return taxonomy_aliases().get(name, name)
+
+def assign_group_codes(df, taxonomy=None):
+    """
+    Adds an int8 GroupCode column (GROUP_CODE_NONE for unmapped accounts).
+    The lookup runs once per distinct Item name, not per row.
+    """
+    taxonomy = taxonomy or load_taxonomy()
+    name_to_code = {
+        name: group["code"]
+        for group in taxonomy["groups"]
+        for account, aliases in group["accounts"].items()
+        for name in [account] + aliases
+    }
+    items = df["Item"].astype("category")
+    category_codes = np.array(
+        [name_to_code.get(str(c), GROUP_CODE_NONE) for c in items.cat.categories] + [GROUP_CODE_NONE],
+        dtype="int8",
+    )
+    # cat.codes is -1 for missing names, which picks the trailing GROUP_CODE_NONE
+    df["GroupCode"] = category_codes[items.cat.codes.to_numpy()]
+    return df
+
+def taxonomy_bs_classes(taxonomy=None):
+    """Returns {balance sheet class key: integer BSClass code}."""
+    taxonomy = taxonomy or load_taxonomy()
+    return {bs["key"]: bs["code"] for bs in taxonomy["balance_sheet"]}
+
+def classify_bs_item(name, taxonomy=None):
+    """
+    Returns the BSClass code of an account name: the first balance sheet class
+    (in taxonomy order) with a keyword contained in the name, else BS_CLASS_NONE.
+    """
+    taxonomy = taxonomy or load_taxonomy()
+    for bs in taxonomy["balance_sheet"]:
+        if any(keyword in name for keyword in bs["keywords"]):
+            return bs["code"]
+    return BS_CLASS_NONE
+
+def assign_bs_classes(df, taxonomy=None):
+    """Adds an int8 BSClass column (current/fixed asset, current liability, equity), once per distinct Item."""
+    taxonomy = taxonomy or load_taxonomy()
+    items = df["Item"].astype("category")
+    category_codes = np.array(
+        [classify_bs_item(str(c), taxonomy) for c in items.cat.categories] + [BS_CLASS_NONE],
+        dtype="int8",
+    )
+    df["BSClass"] = category_codes[items.cat.codes.to_numpy()]
+    return df
+
+def add_lag_metrics(df, lags=None):
+    """
+    Adds <prefix>_Current / <prefix>_Cumulative columns holding the same Item's values
+    `lag` months earlier, for every prefix -> lag in `lags` (default LAG_COLUMNS).
+    Rows without a match get 0. Duplicate (Year, Month, Item) keys resolve to the
+    first row in df order.
+    """
+    if lags is None:
+        lags = LAG_COLUMNS
+    # Months since year 0, so that a lag is a plain integer shift across year boundaries
+    month_index = df["Year"].to_numpy(dtype="int64") * 12 + df["Month"].to_numpy(dtype="int64") - 1
+
+    lookup = pd.DataFrame({
+        "_MonthIndex": month_index,
+        "Item": df["Item"].to_numpy(),
+        "Current": df["Current"].to_numpy(),
+        "Cumulative": df["Cumulative"].to_numpy(),
+        "_Hit": True,
+    }).drop_duplicates(["_MonthIndex", "Item"], keep="first")
+
+    for prefix, lag in lags.items():
+        keys = pd.DataFrame({"_MonthIndex": month_index - lag, "Item": df["Item"].to_numpy()})
+        # Left merge keeps the row order of keys, i.e. of df
+        matched = keys.merge(lookup, on=["_MonthIndex", "Item"], how="left")
+        hit = matched["_Hit"].notna().to_numpy()
+        df[f"{prefix}_Current"] = np.where(hit, matched["Current"].to_numpy(), 0)
+        df[f"{prefix}_Cumulative"] = np.where(hit, matched["Cumulative"].to_numpy(), 0)
+    return df
+
+def list_pdfs(input_dir, fiscal_years=None):
+    """Returns the sorted PDF filenames in input_dir, optionally only those of the given fiscal years."""
+    filenames = sorted(f for f in os.listdir(input_dir) if f.endswith(".pdf"))
+    if fiscal_years is not None:
+        wanted = {int(fy) for fy in fiscal_years}
+        filenames = [f for f in filenames if fiscal_year_of(*parse_period_from_filename(f)) in wanted]
+    return filenames
+
+def input_fingerprint(input_dir, fiscal_years=None):
+    """
+    Returns a cheap fingerprint of input_dir: names, sizes and mtimes of its PDFs (optionally
+    only those of fiscal_years) plus the parser version and taxonomy file.
+    Only stat() calls, so it can run on every rerun.
+    """
+    h = hashlib.sha256(PARSER_VERSION.encode("utf-8"))
+    paths = [TAXONOMY_PATH]
+    if os.path.isdir(input_dir):
+        paths += [os.path.join(input_dir, f) for f in list_pdfs(input_dir, fiscal_years)]
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        h.update(f"{os.path.basename(path)}|{st.st_size}|{st.st_mtime_ns}\n".encode("utf-8"))
+    return h.hexdigest()[:16]
+
+def ledger_version(df):
+    """Returns a short content hash of a ledger DataFrame (stable across processes)."""
+    row_hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    return hashlib.sha256(row_hashes.tobytes()).hexdigest()[:16]
+
+def load_all_data(input_dir, cache_dir=None, use_cache=True, workers=DEFAULT_WORKERS, fiscal_years=None,
+                  max_tasks_per_child=DEFAULT_MAX_TASKS_PER_CHILD):
+    """
+    Parses every PDF in input_dir (or only those of fiscal_years) and returns the combined
+    ledger DataFrame. Each file's parse_pdf result is cached on disk keyed by its content hash,
+    so only new or changed PDFs are re-parsed, in parallel over `workers` processes.
+    Per-file failures are collected in df.attrs["load_errors"] as (filename, message), and
+    per-file timings in df.attrs["file_stats"] as dicts (file, status, rows, seconds).
+    Prev_* columns are only complete for years whose previous year is loaded as well.
+    """
+    if cache_dir is None:
+        cache_dir = os.path.join(input_dir, CACHE_DIRNAME)
+    if use_cache:
+        prune_parse_cache(cache_dir)
+    # Pick up taxonomy edits before cache keys are computed and workers are forked
+    load_taxonomy()
+
+    filenames = list_pdfs(input_dir, fiscal_years)
+    parsed = {}
+    cache_keys = {}
+    errors = []
+    stats = {}
+
+    # 1. Serve unchanged files from the parse cache
+    if use_cache:
+        for f in filenames:
+            start = time.perf_counter()
             try:
-                df = parse_pdf(os.path.join(input_dir, f))
-                if not df.empty:
-                    all_data.append(df)
-            except Exception as e:
-                print(f"Error parsing {f}: {e}")
+                cache_keys[f] = file_cache_key(os.path.join(input_dir, f))
+            except OSError as e:
+                errors.append((f, f"{type(e).__name__}: {e}"))
+                stats[f] = {"file": f, "status": "error", "rows": 0, "seconds": time.perf_counter() - start}
+                continue
+            df = load_cached_parse(cache_dir, cache_keys[f])
+            if df is not None:
+                parsed[f] = df
+                stats[f] = {"file": f, "status": "cached", "rows": len(df), "seconds": time.perf_counter() - start}
+
+    # 2. Parse the rest in parallel
+    to_parse = [f for f in filenames if f not in stats]
+    to_parse_paths = [os.path.join(input_dir, f) for f in to_parse]
+    for filepath, df, error, seconds in parse_files(to_parse_paths, workers=workers, max_tasks_per_child=max_tasks_per_child):
+        f = os.path.basename(filepath)
+        if error is not None:
+            errors.append((f, error))
+            stats[f] = {"file": f, "status": "error", "rows": 0, "seconds": seconds}
+            continue
+        parsed[f] = df
+        stats[f] = {"file": f, "status": "parsed", "rows": len(df), "seconds": seconds}
+        if use_cache:
+            store_cached_parse(cache_dir, cache_keys[f], df)
+
+    file_stats = [stats[f] for f in filenames if f in stats]
+    error_by_file = dict(errors)
+    PARSE_TRACE.extend(
+        trace_record(stat["file"], period=period_label(*parse_period_from_filename(stat["file"])),
+                     rows=stat["rows"], seconds=stat["seconds"], status=stat["status"],
+                     error=error_by_file.get(stat["file"]))
+        for stat in file_stats
+    )
+
+    # Deterministic output order regardless of cache hits / completion order
+    all_data = [parsed[f] for f in filenames if f in parsed and not parsed[f].empty]
     
     if all_data:
         full_df = pd.concat(all_data, ignore_index=True)
         
         # --- FIX: Recompute Cumulative for Dummy Data with Fiscal Year Logic ---
-        # 1. Add Fiscal Year Column (Apr Start)
-        full_df["FiscalYear"] = full_df.apply(lambda x: x["Year"] if x["Month"] >= 4 else x["Year"] - 1, axis=1)
+        # 1. Add Calendar Columns (FiscalYear, FiscalMonth, Period)
+        full_df = add_calendar_columns(full_df)
         
         # 2. Sort to ensure cumsum works chronologically by FY
-        # Fiscal Month Order: Apr=1, ..., Mar=12
-        full_df["FiscalMonth"] = full_df["Month"].apply(lambda x: x - 3 if x >= 4 else x + 9)
         full_df = full_df.sort_values(["FiscalYear", "FiscalMonth"])
         
         # Identify Dummy rows
@@ -268,25 +833,167 @@ def load_all_data(input_dir):
         
         # --- YoY MAPPING LOGIC ---
         # For each (Month, Item, CurrentYear), find (Month, Item, CurrentYear-1)
-        # and populate the 'Previous' column for the CurrentYear items.
+        # and populate the 'Prev_*' columns for the CurrentYear items.
+        full_df = add_lag_metrics(full_df)
         
-        indexed_df = full_df.set_index(["Year", "Month", "Item"])
-        
-        def get_prev_metrics(row):
-            try:
-                # Look for the same month and item in the previous year
-                prev_row = indexed_df.loc[(row["Year"] - 1, row["Month"], row["Item"])]
-                if isinstance(prev_row, pd.DataFrame):
-                    prev_row = prev_row.iloc[0]
-                return prev_row["Current"], prev_row["Cumulative"]
-            except (KeyError, IndexError):
-                return 0, 0
-
-        # Create two new helper columns for comparison
-        res = full_df.apply(get_prev_metrics, axis=1)
-        full_df["Prev_Current"] = [x[0] for x in res]
-        full_df["Prev_Cumulative"] = [x[1] for x in res]
+        # --- Compact Layout ---
+        # Item names are already normalized by parse_pdf (see normalize_account_name)
+        full_df = compact_ledger(full_df)
+        full_df = assign_group_codes(full_df)
+        full_df = assign_bs_classes(full_df)
         
+        # Content hash of the ledger, used by the dashboard to key derived caches
+        full_df.attrs["data_version"] = ledger_version(full_df)
+        full_df.attrs["load_errors"] = errors
+        full_df.attrs["file_stats"] = file_stats
         return full_df
     else:
-        return pd.DataFrame()
+        empty_df = pd.DataFrame()
+        empty_df.attrs["load_errors"] = errors
+        empty_df.attrs["file_stats"] = file_stats
+        return empty_df
+
+def write_ledger_store(df, store_dir, fingerprint=None):
+    """
+    Materializes the ledger as a Parquet dataset partitioned by FiscalYear, replacing any
+    existing store. The new store is built next to the old one and swapped in by rename.
+    """
+    tmp_dir = f"{store_dir}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    if not df.empty:
+        df.to_parquet(tmp_dir, partition_cols=["FiscalYear"], index=False)
+    meta = {
+        "fingerprint": fingerprint,
+        "data_version": df.attrs.get("data_version"),
+        "load_errors": df.attrs.get("load_errors", []),
+        "columns": list(df.columns),
+        "fiscal_years": sorted(int(fy) for fy in df["FiscalYear"].unique()) if not df.empty else [],
+    }
+    with open(os.path.join(tmp_dir, LEDGER_META_FILENAME), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+
+    old_dir = f"{store_dir}.old-{os.getpid()}"
+    if os.path.exists(store_dir):
+        os.rename(store_dir, old_dir)
+    os.rename(tmp_dir, store_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+def read_ledger_meta(store_dir):
+    """Returns the store's metadata dict, or None if there is no (complete) store."""
+    try:
+        with open(os.path.join(store_dir, LEDGER_META_FILENAME), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def read_ledger_store(store_dir, fiscal_years=None):
+    """
+    Reads the ledger from the store. With fiscal_years, only those FiscalYear partitions
+    are read (partition pruning); YoY columns were computed over the full archive at build time.
+    """
+    meta = read_ledger_meta(store_dir)
+    if meta is None:
+        raise FileNotFoundError(f"No ledger store at {store_dir}")
+    if fiscal_years is not None:
+        fiscal_years = [int(fy) for fy in fiscal_years if int(fy) in meta["fiscal_years"]]
+    else:
+        fiscal_years = meta["fiscal_years"]
+
+    if fiscal_years:
+        df = pd.read_parquet(store_dir, filters=[("FiscalYear", "in", fiscal_years)])
+        # The partition column comes back categorical and last; restore layout and dtypes
+        df["FiscalYear"] = df["FiscalYear"].astype("int64")
+        df = compact_ledger(df[meta["columns"]])
+        # Restore the ingest row order (chronological)
+        df = df.sort_values(["FiscalYear", "FiscalMonth"], kind="stable").reset_index(drop=True)
+    else:
+        df = pd.DataFrame()
+    # A subset is a different ledger: give it its own version so caches keyed on it don't collide
+    data_version = meta["data_version"]
+    if fiscal_years != meta["fiscal_years"]:
+        data_version = f"{data_version}:{'-'.join(str(fy) for fy in fiscal_years)}"
+    df.attrs["data_version"] = data_version
+    df.attrs["load_errors"] = [tuple(e) for e in meta["load_errors"]]
+    return df
+
+def load_fiscal_years(input_dir, fiscal_years, store_dir=None, **load_kwargs):
+    """
+    Loads only the given fiscal years: from the Parquet store when it is up to date,
+    otherwise by parsing just those years' PDFs. Pass the previous year too when YoY
+    columns are needed.
+    """
+    if store_dir is None:
+        store_dir = os.path.join(input_dir, LEDGER_STORE_DIRNAME)
+    meta = read_ledger_meta(store_dir)
+    if meta is not None and meta.get("fingerprint") == input_fingerprint(input_dir):
+        return read_ledger_store(store_dir, fiscal_years)
+    return load_all_data(input_dir, fiscal_years=fiscal_years, **load_kwargs)
+
+def load_ledger(input_dir, store_dir=None, fiscal_years=None, **load_kwargs):
+    """
+    Returns the ledger from the Parquet store in input_dir, re-ingesting the PDFs
+    (load_all_data) first when the input_fingerprint no longer matches the store.
+    """
+    if store_dir is None:
+        store_dir = os.path.join(input_dir, LEDGER_STORE_DIRNAME)
+    fingerprint = input_fingerprint(input_dir)
+    meta = read_ledger_meta(store_dir)
+    if meta is None or meta.get("fingerprint") != fingerprint:
+        write_ledger_store(load_all_data(input_dir, **load_kwargs), store_dir, fingerprint)
+    return read_ledger_store(store_dir, fiscal_years)
+
+# --- Command Line ---
+def main(argv=None):
+    """
+    Headless batch ingest, e.g. from cron/CI:
+
+        python src/pdf_parser.py input_data --workers 4
+        python src/pdf_parser.py input_data --format parquet --out ledger.parquet
+
+    Prints per-file timings and exits with status 1 if any PDF failed to parse.
+    """
+    parser = argparse.ArgumentParser(description="Ingest trial balance PDFs into a columnar ledger.")
+    parser.add_argument("input_dir", help="Directory containing the PDF files")
+    parser.add_argument("--out", help=f"Output path (default: <input_dir>/{LEDGER_STORE_DIRNAME} for --format store)")
+    parser.add_argument("--format", choices=["store", "parquet"], default="store",
+                        help="store: Parquet dataset partitioned by FiscalYear, read by the dashboard; "
+                             "parquet: single Parquet file")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Parser processes (default: all cores)")
+    parser.add_argument("--max-tasks-per-child", type=int, default=DEFAULT_MAX_TASKS_PER_CHILD,
+                        help="Restart the parser processes after about this many PDFs each to cap memory")
+    parser.add_argument("--no-cache", action="store_true", help="Re-parse every PDF, ignoring the parse cache")
+    args = parser.parse_args(argv)
+    if args.format == "parquet" and not args.out:
+        parser.error("--out is required for --format parquet")
+
+    if not os.path.isdir(args.input_dir):
+        print(f"Error: input directory not found: {args.input_dir}", file=sys.stderr)
+        return 2
+
+    start = time.perf_counter()
+    # Fingerprint before parsing, so files replaced mid-run make the store stale, not wrong
+    fingerprint = input_fingerprint(args.input_dir)
+    df = load_all_data(args.input_dir, use_cache=not args.no_cache, workers=args.workers,
+                       max_tasks_per_child=args.max_tasks_per_child)
+
+    if args.format == "store":
+        out = args.out or os.path.join(args.input_dir, LEDGER_STORE_DIRNAME)
+        write_ledger_store(df, out, fingerprint)
+    else:
+        out = args.out
+        df.to_parquet(out, index=False)
+
+    for stat in df.attrs.get("file_stats", []):
+        print(f"{stat['status']:>6}  {stat['seconds']:7.3f}s  {stat['rows']:6d} rows  {stat['file']}")
+    for f, error in df.attrs.get("load_errors", []):
+        print(f"FAILED  {f}: {error}", file=sys.stderr)
+    print(f"Wrote {len(df)} rows to {out} in {time.perf_counter() - start:.2f}s")
+    parent_rss, child_rss = peak_rss_mb()
+    if parent_rss is not None:
+        print(f"Peak RSS: {parent_rss:.0f} MB (main), {child_rss:.0f} MB (largest worker)")
+
+    return 1 if df.attrs.get("load_errors") else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,422 @@
+import os
+import sys
+import json
+import time
+import argparse
+
+import google.generativeai as genai
+
+import pdf_parser
+import advisor
+
+# --- Summary Store ---
+# Executive summaries for every (FiscalYear, FiscalMonth, view mode) are built once after
+# ingest and stored as JSON in the input directory; the dashboard reads them instead of
+# rebuilding the report (and any model narrative) on each rerun. Each fiscal year carries
+# the input_fingerprint of the PDFs it was built from (that year and the previous one),
+# so replaced PDFs make its entries stale and the dashboard falls back to building live.
+SUMMARY_VERSION = "1"  # Bump when the report text or figures change
+SUMMARY_STORE_FILENAME = ".summary_store.json"
+VIEW_MODES = ["Current", "Cumulative"]
+
+# --- KPI Cube ---
+# Disjoint base groups; composite KPIs (total sales, total cost) are sums of base groups
+SALES_GROUPS = ["design_sales", "ec_sales"]
+COST_GROUPS = ["design_cost", "ec_cost"]
+OP_GROUP = "op"
+CUBE_COLUMNS = ["Current", "Cumulative", "Prev_Current", "Prev_Cumulative"]
+
+def build_kpi_cube(df):
+    """
+    Aggregates the ledger into {(FiscalYear, FiscalMonth, group): {column: value}}
+    plus the latest FiscalMonth per FY.
+    The OP_GROUP entry holds the first 営業利益 row of the month (not a sum), as reported.
+    Balance sheet classes (taxonomy_bs_classes keys) are included the same way, by BSClass.
+    """
+    group_codes = pdf_parser.taxonomy_group_codes()
+    code_to_group = {code: group for group, code in group_codes.items()}
+    keys = ["FiscalYear", "FiscalMonth"]
+
+    grouped = df[df["GroupCode"] != pdf_parser.GROUP_CODE_NONE]
+    sums = grouped.groupby(keys + ["GroupCode"])[CUBE_COLUMNS].sum()
+    cube = {(int(fy), int(fm), code_to_group[code]): vals for (fy, fm, code), vals in sums.to_dict("index").items()}
+
+    bs_to_key = {code: key for key, code in pdf_parser.taxonomy_bs_classes().items()}
+    bs_sums = df[df["BSClass"] != pdf_parser.BS_CLASS_NONE].groupby(keys + ["BSClass"])[CUBE_COLUMNS].sum()
+    for (fy, fm, code), vals in bs_sums.to_dict("index").items():
+        cube[(int(fy), int(fm), bs_to_key[code])] = vals
+
+    op_rows = df[df["GroupCode"] == group_codes[OP_GROUP]].groupby(keys)[CUBE_COLUMNS].first()
+    for (fy, fm), vals in op_rows.to_dict("index").items():
+        cube[(int(fy), int(fm), OP_GROUP)] = vals
+
+    latest_fm = {int(fy): int(fm) for fy, fm in df.groupby("FiscalYear", observed=True)["FiscalMonth"].max().items()}
+    return cube, latest_fm
+
+def cube_value(cube, groups, col, fy, fiscal_months):
+    """Sums col over the given groups and fiscal months of fy (missing cells count as 0)."""
+    return sum(
+        cube.get((fy, fm, g), {}).get(col, 0)
+        for fm in fiscal_months
+        for g in groups
+    )
+
+# --- Executive Summary ---
+def report_context(cube, fy, period_name, fiscal_months, data_col):
+    """Figures behind one executive summary: P/L of data_col and balance sheet ratios."""
+    # Balance sheet lines are classified at ingest (BSClass); sums come from the KPI cube
+    cur_assets = cube_value(cube, ["current_asset"], "Cumulative", fy, fiscal_months)
+    cur_liab = cube_value(cube, ["current_liability"], "Cumulative", fy, fiscal_months)
+    equity = cube_value(cube, ["equity"], "Cumulative", fy, fiscal_months)
+    fixed_assets = cube_value(cube, ["fixed_asset"], "Cumulative", fy, fiscal_months)
+    total_assets = cur_assets + fixed_assets
+
+    sales = cube_value(cube, SALES_GROUPS, data_col, fy, fiscal_months)
+    cogs = cube_value(cube, COST_GROUPS, data_col, fy, fiscal_months)
+    gp = sales - cogs
+    sga = cube_value(cube, ["sga"], data_col, fy, fiscal_months)
+    op = gp - sga
+
+    return {
+        "period": period_name,
+        "sales": sales, "gp": gp, "op": op, "gp_rate": gp/sales if sales else 0,
+        "cur_ratio": (cur_assets / cur_liab * 100) if cur_liab else 0,
+        "equity_ratio": (equity / total_assets * 100) if total_assets else 0
+    }
+
+def monthly_figures(ctx):
+    """Derived P/L figures of a monthly report_context (SG&A is estimated as gp - op)."""
+    gp = ctx['gp']
+    op = ctx['op']
+    sales = ctx['sales']
+    sga_est = gp - op  # Estimated SG&A
+    return {
+        "sales": sales, "gp": gp, "op": op, "sga_est": sga_est,
+        "op_rate": op / sales if sales else 0,
+        "sga_rate": sga_est / sales if sales else 0,
+        "gp_consume_rate": (sga_est / gp * 100) if gp else 0,
+    }
+
+def monthly_report(ctx):
+    """Markdown of the monthly executive summary: highlights, diagnoses and recommendations."""
+    figures = monthly_figures(ctx)
+    sales, gp, op, sga_est = figures["sales"], figures["gp"], figures["op"], figures["sga_est"]
+    op_rate, sga_rate, gp_consume_rate = figures["op_rate"], figures["sga_rate"], figures["gp_consume_rate"]
+
+    # Diagnostic logic based on actual data
+    profitability_diagnosis = ""
+    if op < 0:
+        profitability_diagnosis = "🚨 **赤字警告**: 営業利益がマイナスです。販管費が粗利益を上回っています。早急にコスト構造の見直しが必要です。"
+    elif op_rate < 0.03:
+        profitability_diagnosis = "⚠️ **注意**: 営業利益率が3%未満です。販管費の削減または粗利率改善による収益性強化を検討してください。"
+    elif op_rate < 0.05:
+        profitability_diagnosis = "✅ 収益性は安定していますが、さらなる改善の余地があります。"
+    else:
+        profitability_diagnosis = "✅ **良好**: 営業利益率が5%以上で、健全な収益構造です。"
+    
+    sga_diagnosis = ""
+    if gp_consume_rate > 90:
+        sga_diagnosis = "🚨 **警告**: 販管費が粗利益の90%以上を消費しています。固定費の見直しが急務です。"
+    elif gp_consume_rate > 70:
+        sga_diagnosis = "⚠️ 販管費が粗利益の70%以上を占めています。改善の余地あり。"
+    else:
+        sga_diagnosis = "✅ 販管費は適正にコントロールされています。"
+    
+    safety_diagnosis = ""
+    cur_ratio = ctx['cur_ratio']
+    eq_ratio = ctx['equity_ratio']
+    
+    if cur_ratio < 100:
+        safety_diagnosis += "🚨 **流動比率が100%未満**: 短期的な支払い能力に懸念があります。資金繰りの改善が必要です。\n"
+    elif cur_ratio < 150:
+        safety_diagnosis += "⚠️ 流動比率が150%未満です。短期負債の返済余力に注意が必要です。\n"
+    elif cur_ratio > 300:
+        safety_diagnosis += "💰 流動比率が300%以上と非常に高いです。過剰な資金を成長投資に回すことを検討してください。\n"
+    else:
+        safety_diagnosis += "✅ 流動比率は安全圈内です。\n"
+    
+    if eq_ratio < 20:
+        safety_diagnosis += "🚨 **自己資本比率が20%未満**: 財務基盤が脆弱です。内部留保の強化または増資を検討してください。"
+    elif eq_ratio < 40:
+        safety_diagnosis += "⚠️ 自己資本比率が40%未満です。安定性はありますが、さらなる強化が望ましいです。"
+    else:
+        safety_diagnosis += "✅ 自己資本比率は十分に高く、財務基盤は盤石です。"
+    
+    # Generate specific recommendations based on data
+    recommendations = []
+    if op < 0:
+        recommendations.append("販管費の科目別分析を行い、削減可能な項目を特定")
+    if gp_consume_rate > 70:
+        recommendations.append("人件費・地代家賃などの固定費の見直し")
+    if sga_rate > 0.3:
+        recommendations.append("売上高に対する販管費率の目標設定とモニタリング")
+    if ctx['gp_rate'] < 0.4:
+        recommendations.append("原価構造の見直し（外注費の最適化、仕入先の解約）")
+    if cur_ratio > 300:
+        recommendations.append("過剰な流動資産の成長投資への活用検討")
+    if not recommendations:
+        recommendations.append("現状の健全な財務体質を維持しつつ、成長投資の機会を探る")
+    
+    rec_list = "\n    ".join([f"{i+1}. {r}" for i, r in enumerate(recommendations)])
+    
+    report_monthly = f"""
+    ### 👔 エグゼクティブ・サマリー ({ctx['period']})
+    
+    > ℹ️ **データソース**: 本レポートの全数値は試算表PDFデータから自動取得されています。
+    
+    ---
+    
+    #### 📊 当月の財務ハイライト
+    
+    | 指標 | 値 | 対売上高比率 |
+    |------|------|------|
+    | 売上高 | ¥{sales:,.0f} | 100% |
+    | 粗利益 | ¥{gp:,.0f} | {ctx['gp_rate']:.1%} |
+    | 販管費 | ¥{sga_est:,.0f} | {sga_rate:.1%} |
+    | 営業利益 | ¥{op:,.0f} | {op_rate:.1%} |
+    
+    | 安全性指標 | 値 |
+    |------|------|
+    | 流動比率 | {ctx['cur_ratio']:.1f}% |
+    | 自己資本比率 | {ctx['equity_ratio']:.1f}% |
+    
+    ---
+    
+    #### 🩺 財務診断
+    
+    **収益性の評価**
+    
+    {profitability_diagnosis}
+    
+    - 粗利率 **{ctx['gp_rate']:.1%}** : 売上1円あたり **¥{ctx['gp_rate']:.2f}** が粗利益として残ります。
+    - 販管費率 **{sga_rate:.1%}** : {sga_diagnosis}
+    - 営業利益率 **{op_rate:.1%}** : 最終的に売上1円あたり **¥{op_rate:.2f}** が利益として残っています。
+    
+    **安全性の評価**
+    
+    {safety_diagnosis}
+    
+    ---
+    
+    #### 💡 コンサルタントからの提言
+    
+    **優先対応事項**:
+    
+    {rec_list}
+    
+    **確認ポイント**:
+    
+    - 売上原価の内訳（特に外注費）が前月と比較して変動していないか
+    - 販管費の主要科目（人件費・地代家賃）の推移
+    - 売掛金・買掛金の残高と回収・支払サイクル
+    """
+    return report_monthly
+
+def annual_report(ctx):
+    """Markdown of the annual trend report."""
+    op_rate = ctx['op']/ctx['sales'] if ctx['sales'] else 0
+    report_annual = f"""
+    ### 📈 通期経営トレンド分析 ({ctx['period']}) - Powered by Gemini 3 Pro
+    
+    ---
+    
+    #### 📊 通期財務サマリー
+    
+    | 指標 | 値 | 前年比 |
+    |------|------|--------|
+    | 累計売上高 | ¥{ctx['sales']:,.0f} | - |
+    | 累計粗利益 | ¥{ctx['gp']:,.0f} | - |
+    | 営業利益率 | {op_rate:.1%} | - |
+    | 粗利率 | {ctx['gp_rate']:.1%} | - |
+    
+    ---
+    
+    #### 🔍 通期概況と成長の質
+    
+    年度累計売上高は **¥{ctx['sales']:,.0f}**、営業利益率は **{op_rate:.1%}** をマーク。
+    
+    **規模の経済性分析**:
+    - 事業規模の拡大に伴い、販管費（SG&A）の効率性が問われる局面に入っています。
+    - 売上の伸び以上に固定費が膨らんでいないか、月別推移から「筋肉質な経営」への移行度を確認すべきです。
+    
+    **セグメント別視点**:
+    - デザイン事業: 高付加価値・高粗利率だがスケーラビリティに課題
+    - EC事業: スケールメリットがあるが粗利率は低め
+    
+    ---
+    
+    #### 🚨 リスクと機会
+    
+    **リスク要因**:
+    1. 売掛金の滞留によるキャッシュフロー悪化
+    2. 在庫回転率の低下による運転資金圧迫
+    3. 外注依存度の高さによるコストコントロールの難しさ
+    
+    **成長機会**:
+    1. デザイン×ECのクロスセル（オリジナル商品開発）
+    2. サブスクリプション型サービスの導入（定期収益化）
+    3. フリーランス人材の活用による固定費の変動費化
+    
+    ---
+    
+    #### 💡 戦略提言：価値最大化への道筋
+    
+    キャッシュフローマネジメントの観点から、売掛金の滞留リスクや在庫の回転率を再点検してください。
+    
+    現在は外部環境の変化に強い財務基盤を構築できていますが、これを維持しつつ、デザイン事業の高い付加価値をEC事業のスケールメリットにどう波及させるかが、年度末に向けた最重要課題です。
+    """
+    return report_annual
+
+# --- Narrative ---
+NARRATIVE_PROMPT = """
+あなたは世界最高峰の戦略コンサルティングファームに所属する、極めて有能なシニアパートナーです。
+最新の **Gemini 3 Pro** モデルを駆使し、提供された財務データを多角的に分析し、経営者に対して「数字の裏にある意味」と「未来への布石」を提示してください。
+
+分析のポイント：
+- **過去データとの比較**: 前年、前月と比較して、どの動向が「異常」であり、どの動向が「健全な成長」かを明示。
+- **気になる点/リスク**: 表面的な利益だけでなく、キャッシュフローの阻害要因や固定費の予期せぬ上昇を指摘。
+- **具体的かつ平易な言葉**: 専門用語に逃げず、経営者が直感的に理解でき、すぐに意思決定に活かせる言葉を使用。
+- **長期的視点**: 単なる今月の反省ではなく、通期目標達成に向けた軌道修正案を提示。
+"""
+
+def generate_narrative(model, report, timeout=advisor.DEFAULT_TIMEOUT):
+    """Asks the model for a short commentary on report; returns None if the call fails."""
+    prompt = f"{NARRATIVE_PROMPT}\n以下のレポートについて、経営者向けのコメントを400字程度で作成してください。\n\n{report.strip()}"
+    try:
+        return "".join(advisor.stream_text(model, prompt, timeout=timeout)).strip() or None
+    except Exception as e:
+        print(f"Narrative generation failed: {e}", file=sys.stderr)
+        return None
+
+# --- Batch ---
+def build_summaries(ledger, fingerprints, model=None):
+    """
+    Builds the monthly summary of every (FiscalYear, FiscalMonth, view mode) and the annual
+    summary of every (FiscalYear, view mode) in ledger, for the fiscal years in fingerprints
+    ({fiscal year: input_fingerprint of its PDFs}, taken before the ledger was loaded).
+    With a model, each entry also gets a narrative. Returns the store contents keyed by
+    fiscal year (str, as in JSON); empty if the ledger has no rows.
+    """
+    if ledger.empty:
+        return {}
+    cube, _ = build_kpi_cube(ledger)
+    months = pdf_parser.fiscal_calendar().set_index("FiscalMonth")["Month"]
+    available = ledger.groupby("FiscalYear", observed=True)["FiscalMonth"].unique()
+    available = available[available.index.isin(list(fingerprints))]
+
+    def entry(report):
+        summary = {"report": report}
+        if model is not None:
+            summary["narrative"] = generate_narrative(model, report)
+        return summary
+
+    store = {}
+    for fy, fiscal_months in available.items():
+        fy = int(fy)
+        monthly = {}
+        for fm in sorted(int(m) for m in fiscal_months):
+            monthly[str(fm)] = {
+                data_col: entry(monthly_report(report_context(cube, fy, f"{months[fm]}月度", [fm], data_col)))
+                for data_col in VIEW_MODES
+            }
+        annual = {
+            data_col: entry(annual_report(report_context(cube, fy, f"{fy}年度 通期累計", range(1, 13), data_col)))
+            for data_col in VIEW_MODES
+        }
+        store[str(fy)] = {
+            "fingerprint": fingerprints[fy],
+            "monthly": monthly,
+            "annual": annual,
+        }
+    return store
+
+def write_summary_store(fiscal_years, path):
+    """Writes the summaries (as returned by build_summaries) to path, atomically."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"version": SUMMARY_VERSION, "fiscal_years": fiscal_years}, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def read_summary_store(path):
+    """Returns the stored summaries by fiscal year, or None if missing, unreadable or outdated."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            store = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if store.get("version") != SUMMARY_VERSION:
+        return None
+    return store.get("fiscal_years")
+
+def lookup_summary(store, fiscal_year, fingerprint, data_col, fiscal_month=None):
+    """
+    Returns the stored {"report", "narrative"} entry of the monthly (fiscal_month given)
+    or annual summary, or None when it is missing or the year's PDFs changed since.
+    """
+    year = (store or {}).get(str(fiscal_year))
+    if year is None or year.get("fingerprint") != fingerprint:
+        return None
+    if fiscal_month is None:
+        return year["annual"].get(data_col)
+    return year["monthly"].get(str(fiscal_month), {}).get(data_col)
+
+# --- Command Line ---
+def main(argv=None):
+    """
+    Precomputes the executive summaries after ingest, e.g. from cron/CI:
+
+        python src/pdf_parser.py input_data
+        python src/summaries.py input_data --narrative
+
+    Reads the ledger store (re-ingesting if it is stale) and writes <input_dir>/.summary_store.json.
+    """
+    parser = argparse.ArgumentParser(description="Precompute the dashboard's executive summaries.")
+    parser.add_argument("input_dir", help="Directory containing the PDF files")
+    parser.add_argument("--out", help=f"Output path (default: <input_dir>/{SUMMARY_STORE_FILENAME})")
+    parser.add_argument("--fiscal-year", type=int, action="append", dest="fiscal_years",
+                        help="Only this fiscal year (repeatable); other stored years are kept")
+    parser.add_argument("--narrative", action="store_true",
+                        help="Also generate a model narrative per summary (needs GOOGLE_API_KEY)")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.input_dir):
+        print(f"Error: input directory not found: {args.input_dir}", file=sys.stderr)
+        return 2
+
+    model = None
+    if args.narrative:
+        api_key = os.environ.get("GOOGLE_API_KEY", "")
+        if api_key:
+            genai.configure(api_key=api_key)
+        model = advisor.get_model(api_key)
+        if model is None:
+            print("Error: --narrative needs GOOGLE_API_KEY", file=sys.stderr)
+            return 2
+
+    start = time.perf_counter()
+    out = args.out or os.path.join(args.input_dir, SUMMARY_STORE_FILENAME)
+    # Fingerprint before loading, so PDFs replaced mid-run make the summaries stale, not wrong
+    fiscal_years = args.fiscal_years or pdf_parser.discover_fiscal_years(args.input_dir)
+    fingerprints = {fy: pdf_parser.input_fingerprint(args.input_dir, [fy - 1, fy]) for fy in fiscal_years}
+    # The previous year is needed for the Prev_* (year-over-year) columns
+    load_years = None
+    if args.fiscal_years:
+        load_years = sorted({y for fy in args.fiscal_years for y in (fy - 1, fy)})
+    ledger = pdf_parser.load_ledger(args.input_dir, fiscal_years=load_years)
+    for f, error in ledger.attrs.get("load_errors", []):
+        print(f"FAILED  {f}: {error}", file=sys.stderr)
+    if ledger.empty:
+        print(f"Error: no ledger data in {args.input_dir} for the requested fiscal years", file=sys.stderr)
+        return 1
+
+    store = (read_summary_store(out) or {}) if args.fiscal_years else {}
+    store.update(build_summaries(ledger, fingerprints, model))
+    write_summary_store(store, out)
+
+    count = sum(len(year["monthly"]) for year in store.values())
+    print(f"Wrote summaries for {len(store)} fiscal years ({count} months) to {out} "
+          f"in {time.perf_counter() - start:.2f}s")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
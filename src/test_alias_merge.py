@@ -0,0 +1,30 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import pdf_parser as parser
+import pandas as pd
+
+def trial_balance(year, month, amounts):
+    """Rows of one document in the real table layout: [_, _, name, prev, debit, credit, curr, ratio]."""
+    table = [[None, None, name, "0", str(value), "0", str(value), "1.0"] for name, value in amounts]
+    rows = list(parser._table_rows([table], year, month, f"shisanhyou_{year}{month:02d}.pdf"))
+    return parser.merge_alias_rows(pd.DataFrame(rows))
+
+def test():
+    # 地代家賃 and its alias 支払家賃 in the same PDF must end up as one 地代家賃 row
+    prev_year = trial_balance(2024, 5, [("地代家賃", 100), ("支払家賃", 50)])
+    this_year = trial_balance(2025, 5, [("地代家賃", 120), ("支払家賃", 60)])
+    print(prev_year[["Year", "Month", "Item", "Current"]])
+
+    df = parser.add_lag_metrics(pd.concat([prev_year, this_year], ignore_index=True))
+    rent = df[(df["Year"] == 2025) & (df["Item"] == "地代家賃")]
+    print(rent[["Item", "Current", "Prev_Current"]])
+
+    assert len(rent) == 1, "aliased rows were not merged"
+    assert rent["Current"].sum() == 180
+    assert rent["Prev_Current"].sum() == 150, "YoY picked up only one of the aliased rows"
+    print("OK")
+
+if __name__ == "__main__":
+    test()
@@ -15,7 +15,7 @@ def verify_data_loading():
         print("Error: input_data directory not found.")
         return
 
-    df = pdf_parser.load_all_data(input_dir)
+    df = pdf_parser.load_ledger(input_dir)
     
     if df.empty:
         print("Error: No data loaded.")